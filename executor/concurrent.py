@@ -1,7 +1,7 @@
 # Programmer friendly subprocess wrapper.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: May 14, 2020
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -288,7 +288,7 @@ class CommandPool(PropertyManager):
             with self.get_spinner(timer) as spinner:
                 num_started = 0
                 num_collected = 0
-                while not self.is_finished:
+                while True:
                     # When concurrency is set to one (I know, initially it
                     # sounds like a silly use case, bear with me) I want the
                     # start_event and finish_event callbacks of external
@@ -297,9 +297,17 @@ class CommandPool(PropertyManager):
                     if self.concurrency > (num_started - num_collected):
                         num_started += self.spawn()
                     num_collected += self.collect()
+                    # Counting the finished commands requires a scan of the
+                    # whole pool, so we do this once per iteration (after
+                    # spawning and collecting, so the count is up to date)
+                    # and use the result for both the exit condition and
+                    # the spinner label.
+                    num_finished = self.num_finished
+                    if num_finished >= self.num_commands:
+                        break
                     spinner.step(label=format(
                         "Waiting for %i/%i %s",
-                        self.num_commands - self.num_finished, self.num_commands,
+                        self.num_commands - num_finished, self.num_commands,
                         "command" if self.num_commands == 1 else "commands",
                     ))
                     spinner.sleep()
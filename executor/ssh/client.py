@@ -1,7 +1,7 @@
 # Programmer friendly subprocess wrapper.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: November 19, 2020
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -31,6 +31,7 @@ from humanfriendly import Timer
 from humanfriendly.text import concatenate, pluralize
 from property_manager import (
     PropertyManager,
+    lazy_property,
     mutable_property,
     required_property,
     set_property,
@@ -327,9 +328,11 @@ class RemoteCommand(RemoteAccount, ExternalCommand):
                      and :class:`.ExternalCommand` classes.
         :param options: Keyword arguments can be used to conveniently override
                         the values of :attr:`batch_mode`,
-                        :attr:`connect_timeout`, :attr:`identity_file`,
+                        :attr:`connect_timeout`, :attr:`control_path`,
+                        :attr:`control_persist`, :attr:`identity_file`,
                         :attr:`ignore_known_hosts`, :attr:`log_level`,
-                        :attr:`port`, :attr:`strict_host_key_checking`,
+                        :attr:`multiplex`, :attr:`port`,
+                        :attr:`strict_host_key_checking`,
                         :attr:`known_hosts_file`, :attr:`ssh_command` and the
                         writable properties of the base classes
                         :class:`RemoteAccount` and :class:`.ExternalCommand`.
@@ -414,6 +417,10 @@ class RemoteCommand(RemoteAccount, ExternalCommand):
         else:
             ssh_command.extend(('-o', 'StrictHostKeyChecking=%s' % ('yes' if self.strict_host_key_checking else 'no')))
         ssh_command.extend(('-o', 'UserKnownHostsFile=%s' % self.known_hosts_file))
+        if self.multiplex:
+            ssh_command.extend(('-o', 'ControlMaster=auto'))
+            ssh_command.extend(('-o', 'ControlPath=%s' % self.control_path))
+            ssh_command.extend(('-o', 'ControlPersist=%s' % self.control_persist))
         if self.compression:
             ssh_command.append('-C')
         if self.tty:
@@ -450,6 +457,38 @@ class RemoteCommand(RemoteAccount, ExternalCommand):
         """
         return DEFAULT_CONNECT_TIMEOUT
 
+    @mutable_property
+    def control_path(self):
+        """
+        Control the SSH client option ``ControlPath`` (a string).
+
+        The pathname of the UNIX socket used to share a single SSH connection
+        between :class:`RemoteCommand` objects when :attr:`multiplex` is
+        enabled. The default is ``~/.ssh/executor-%C`` where ``%C`` is
+        expanded by the SSH client to a hash of the local host name, remote
+        host name, port number and username, so that each remote account
+        gets its own socket. The socket is created in ``~/.ssh`` instead of a
+        world writable directory like ``/tmp`` so that other users can't
+        interfere with it.
+        """
+        return os.path.expanduser('~/.ssh/executor-%C')
+
+    @mutable_property
+    def control_persist(self):
+        """
+        Control the SSH client option ``ControlPersist`` (defaults to '60s').
+
+        The following description is quoted from `man ssh_config`_:
+
+          When used in conjunction with ``ControlMaster``, specifies that the
+          master connection should remain open in the background (waiting for
+          future client connections) after the initial client connection has
+          been closed.
+
+        This property is only used when :attr:`multiplex` is enabled.
+        """
+        return '60s'
+
     @property
     def directory(self):
         """
@@ -563,6 +602,27 @@ class RemoteCommand(RemoteAccount, ExternalCommand):
         """
         return 'info'
 
+    @mutable_property
+    def multiplex(self):
+        """
+        Whether to share SSH connections between remote commands (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` the SSH client options ``ControlMaster``,
+        ``ControlPath`` and ``ControlPersist`` are used so that the first
+        :class:`RemoteCommand` that connects to a remote account opens a
+        master connection and subsequent remote commands (for the same
+        remote account) reuse that connection instead of each paying for a
+        new TCP connection, key exchange and authentication. The master
+        connection stays open for :attr:`control_persist` after the last
+        remote command finishes.
+
+        When several remote commands for the same remote account are started
+        at the same time only one of them becomes the master, the others
+        simply connect directly (as they would without multiplexing). See
+        also :attr:`control_path`.
+        """
+        return False
+
     @mutable_property
     def ssh_command(self):
         """
@@ -709,10 +769,16 @@ class SecureTunnel(RemoteCommand):
 
         When the value of :attr:`local_port` isn't specified a free
         ephemeral port number is automatically selected using
-        :class:`~executor.tcp.EphemeralPortAllocator`.
+        :class:`~executor.tcp.EphemeralPortAllocator`. The reservation of
+        the port number is released once the tunnel is accepting
+        connections or when the tunnel is cleaned up.
         """
-        allocator = EphemeralPortAllocator()
-        return allocator.port_number
+        return self.port_allocator.port_number
+
+    @lazy_property
+    def port_allocator(self):
+        """The :class:`~executor.tcp.EphemeralPortAllocator` used to select :attr:`local_port`."""
+        return EphemeralPortAllocator()
 
     @mutable_property
     def remote_host(self):
@@ -744,6 +810,15 @@ class SecureTunnel(RemoteCommand):
         WaitUntilConnected(
             port_number=self.local_port,
         ).wait_until_connected()
+        # Now that the SSH client is listening on the local port, other
+        # allocators will find the port in use, so the reservation is
+        # no longer needed.
+        self.port_allocator.release_port_number()
+
+    def cleanup(self):
+        """Release the allocated port number and clean up the SSH client process."""
+        self.port_allocator.release_port_number()
+        super(SecureTunnel, self).cleanup()
 
 
 class RemoteConnectFailed(ExternalCommandFailed):
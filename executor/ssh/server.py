@@ -1,7 +1,7 @@
 # Programmer friendly subprocess wrapper.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: May 4, 2018
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -14,20 +14,25 @@ test remote command execution).
 """
 
 # Standard library modules.
+import getpass
 import logging
 import os
 import shutil
 import tempfile
+import time
 
 # Modules included in our package.
-from executor import execute, which
+from executor import ExternalCommand, ExternalCommandFailed, which
 from executor.tcp import EphemeralTCPServer, TimeoutError
 
 # External dependencies.
-from humanfriendly import Timer
+from humanfriendly import Timer, format_timespan
+from humanfriendly.text import format
 
 # Public identifiers that require documentation.
 __all__ = (
+    'CURRENT_USER',
+    'SSHD_CONFIG_TEMPLATE',
     'SSHD_PROGRAM_NAME',
     'SSHServer',
     'logger',
@@ -39,9 +44,38 @@ __all__ = (
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
+try:
+    CURRENT_USER = getpass.getuser()
+    """
+    The name of the user running the SSH server (a string).
+
+    This is looked up once when the module is imported. The lookup uses
+    :func:`getpass.getuser()` which checks the ``$USER`` environment variable
+    (and a few related variables) before falling back to the password
+    database. When that fails the numeric user ID is used instead.
+    """
+except (KeyError, OSError):
+    # In containers the environment variables checked by getuser() may be
+    # unset while the user ID has no entry in the password database.
+    CURRENT_USER = str(os.getuid())
+
 SSHD_PROGRAM_NAME = 'sshd'
 """The name of the SSH server executable (a string)."""
 
+SSHD_CONFIG_TEMPLATE = """
+AllowUsers %(user)s
+AuthorizedKeysFile %(client_key_file)s.pub
+HostKey %(host_key_file)s
+LogLevel QUIET
+PasswordAuthentication no
+PidFile %(pid_file)s
+Port %(port_number)i
+StrictModes no
+UsePAM no
+UsePrivilegeSeparation no
+""".lstrip()
+"""The template used by :func:`SSHServer.generate_config()` (a string with ``%(name)s`` placeholders)."""
+
 
 class SSHServer(EphemeralTCPServer):
 
@@ -71,6 +105,8 @@ class SSHServer(EphemeralTCPServer):
         """The pathname of the generated OpenSSH server configuration file (a string)."""
         self.host_key_file = os.path.join(self.temporary_directory, 'host-key')
         """The random port number on which the SSH server will listen (an integer)."""
+        self.pid_file = os.path.join(self.temporary_directory, 'sshd.pid')
+        """The pathname of the pid file written by the OpenSSH server (a string)."""
         # Initialize the superclass.
         options.setdefault('scheme', 'ssh')
         options.setdefault('logger', logger)
@@ -110,24 +146,85 @@ class SSHServer(EphemeralTCPServer):
         """
         if not self.was_started:
             self.logger.debug("Preparing to start SSH server ..")
-            for key_file in (self.host_key_file, self.client_key_file):
-                self.generate_key_file(key_file)
+            # The host and client keys are independent of each other so we
+            # run both ssh-keygen commands concurrently and wait for both.
+            timer = Timer()
+            key_type = 'ed25519'
+            key_files = (self.host_key_file, self.client_key_file)
+            commands = [self.generate_key_file(fn, asynchronous=True, key_type=key_type) for fn in key_files]
+            try:
+                for key_file, cmd in zip(key_files, commands):
+                    if cmd is not None:
+                        try:
+                            cmd.wait()
+                        except ExternalCommandFailed:
+                            # Fall back to RSA keys when ssh-keygen doesn't support the preferred key type.
+                            self.logger.debug("Failed to generate %s key, falling back to RSA ..", key_type)
+                            self.generate_key_file(key_file, key_type='rsa')
+            finally:
+                # Make sure we don't leave any ssh-keygen processes behind
+                # when an unexpected exception is propagated to the caller.
+                for cmd in commands:
+                    if cmd is not None and cmd.subprocess is not None:
+                        cmd.wait(check=False)
+            self.logger.debug("Generated SSH key files in %s.", timer)
             self.generate_config()
             super(SSHServer, self).start()
 
-    def generate_key_file(self, filename):
+    def wait_until_connected(self, timeout=None):
+        """
+        Wait until the SSH server is accepting connections.
+
+        :param timeout: The maximum number of seconds to wait (a number,
+                        defaults to :attr:`~executor.tcp.WaitUntilConnected.wait_timeout`).
+        :raises: :exc:`~executor.tcp.TimeoutError` when the SSH server isn't
+                 fast enough to initialize.
+
+        The OpenSSH server writes :attr:`pid_file` after it has started
+        listening for connections, so this method waits for the pid file to
+        appear (which is a lot cheaper than repeated connection attempts)
+        before confirming that the server is accepting connections using
+        :func:`~executor.tcp.WaitUntilConnected.wait_until_connected()`.
+        Both steps share a single deadline of `timeout` seconds.
+        """
+        timer = Timer()
+        wait_timeout = self.wait_timeout if timeout is None else timeout
+        while self.is_running and not os.path.exists(self.pid_file):
+            if timer.elapsed_time > wait_timeout:
+                raise TimeoutError(format(
+                    "SSH server didn't write %s within configured timeout of %s!",
+                    self.pid_file, format_timespan(wait_timeout),
+                ))
+            time.sleep(0.01)
+        self.logger.debug("Waited %s for SSH server to write pid file.", timer)
+        super(SSHServer, self).wait_until_connected(timeout=max(0, wait_timeout - timer.elapsed_time))
+
+    def generate_key_file(self, filename, asynchronous=False, key_type='ed25519'):
         """
         Generate a temporary host or client key for the OpenSSH server.
 
+        :param filename: The pathname of the key file to generate (a string).
+        :param asynchronous: :data:`True` to start ``ssh-keygen`` without
+                             waiting for it to finish, :data:`False` (the
+                             default) to wait for it to finish.
+        :param key_type: The type of key to generate (a string, defaults to
+                         'ed25519' because generating Ed25519 keys is nearly
+                         instantaneous while RSA key generation is slow).
+        :returns: The :class:`.ExternalCommand` object that runs ``ssh-keygen``
+                  or :data:`None` when the key file already exists.
+
         The :func:`start()` method automatically calls :func:`generate_key_file()`
         to generate :data:`host_key_file` and :attr:`client_key_file`. This
         method uses the ``ssh-keygen`` program to generate the keys.
         """
         if not os.path.isfile(filename):
-            timer = Timer()
             self.logger.debug("Generating SSH key file (%s) ..", filename)
-            execute('ssh-keygen', '-f', filename, '-N', '', '-t', 'rsa', silent=True, logger=self.logger)
-            self.logger.debug("Generated key file %s in %s.", filename, timer)
+            cmd = ExternalCommand(
+                'ssh-keygen', '-f', filename, '-N', '', '-t', key_type,
+                asynchronous=asynchronous, silent=True, logger=self.logger,
+            )
+            cmd.start()
+            return cmd
 
     def generate_config(self):
         """
@@ -139,16 +236,13 @@ class SSHServer(EphemeralTCPServer):
         if not os.path.isfile(self.config_file):
             self.logger.debug("Generating SSH server configuration (%s) ..", self.config_file)
             with open(self.config_file, 'w') as handle:
-                handle.write("AllowUsers %s\n" % os.environ['USER'])
-                handle.write("AuthorizedKeysFile %s.pub\n" % (self.client_key_file))
-                handle.write("HostKey %s\n" % self.host_key_file)
-                handle.write("LogLevel QUIET\n")
-                handle.write("PasswordAuthentication no\n")
-                handle.write("PidFile %s/sshd.pid\n" % self.temporary_directory)
-                handle.write("Port %i\n" % self.port_number)
-                handle.write("StrictModes no\n")
-                handle.write("UsePAM no\n")
-                handle.write("UsePrivilegeSeparation no\n")
+                handle.write(SSHD_CONFIG_TEMPLATE % dict(
+                    user=CURRENT_USER,
+                    client_key_file=self.client_key_file,
+                    host_key_file=self.host_key_file,
+                    pid_file=self.pid_file,
+                    port_number=self.port_number,
+                ))
 
     def cleanup(self):
         """Clean up :attr:`temporary_directory` after the test server finishes."""
@@ -1,7 +1,7 @@
 # Programmer friendly subprocess wrapper.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 2, 2020
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -15,10 +15,11 @@ needed similar logic again and I decided to extract this code from the
 """
 
 # Standard library modules.
-import itertools
 import logging
 import random
 import socket
+import threading
+import time
 
 # Modules included in our package.
 from executor import ExternalCommand
@@ -29,6 +30,7 @@ from humanfriendly.terminal.spinners import Spinner
 from humanfriendly.text import format, pluralize
 from property_manager import (
     PropertyManager,
+    clear_property,
     lazy_property,
     mutable_property,
     required_property,
@@ -39,6 +41,7 @@ from property_manager import (
 __all__ = (
     'EphemeralPortAllocator',
     'EphemeralTCPServer',
+    'PortAllocationError',
     'TimeoutError',
     'WaitUntilConnected',
     'logger',
@@ -69,14 +72,19 @@ class WaitUntilConnected(PropertyManager):
 
     @property
     def is_connected(self):
-        """:data:`True` if a connection was accepted, :data:`False` otherwise."""
+        """
+        :data:`True` if a connection was accepted, :data:`False` otherwise.
+
+        This uses :func:`attempt_connection()` so that a refused connection
+        is reported as soon as the kernel rejects it, while the
+        :attr:`connect_timeout` still applies to hosts that don't respond.
+        """
         timer = Timer()
         logger.debug("Checking whether %s is accepting connections ..", self.endpoint)
-        try:
-            socket.create_connection((self.hostname, self.port_number), self.connect_timeout)
+        if self.attempt_connection():
             logger.debug("Yes %s is accepting connections (took %s).", self.endpoint, timer)
             return True
-        except Exception:
+        else:
             logger.debug("No %s isn't accepting connections (took %s).", self.endpoint, timer)
             return False
 
@@ -94,24 +102,85 @@ class WaitUntilConnected(PropertyManager):
         """The timeout in seconds for :func:`wait_until_connected()` (a number, defaults to 30)."""
         return 30
 
-    def wait_until_connected(self):
+    def resolve_endpoint(self):
+        """
+        Resolve :attr:`hostname` and :attr:`port_number` to socket addresses.
+
+        :returns: A list of tuples as returned by :func:`socket.getaddrinfo()`
+                  (an empty list when the host name can't be resolved).
+        """
+        try:
+            return socket.getaddrinfo(self.hostname, self.port_number, 0, socket.SOCK_STREAM)
+        except socket.error:
+            return []
+
+    def attempt_connection(self, timeout=None, addresses=None):
+        """
+        Check whether the TCP endpoint accepts connections.
+
+        :param timeout: The maximum number of seconds to wait for the
+                        connection to be established (a number, defaults
+                        to :attr:`connect_timeout`).
+        :param addresses: The result of :func:`resolve_endpoint()` (defaults
+                          to calling :func:`resolve_endpoint()`).
+        :returns: :data:`True` if a connection was accepted, :data:`False` otherwise.
+
+        The connection is made using :func:`~socket.socket.connect_ex()` on a
+        socket with a timeout, so the kernel reports an accepted or refused
+        connection right away while hosts that don't respond are given up on
+        after `timeout` seconds.
+        """
+        if timeout is None:
+            timeout = self.connect_timeout
+        if addresses is None:
+            addresses = self.resolve_endpoint()
+        for family, socktype, proto, canonname, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(timeout)
+                if sock.connect_ex(address) == 0:
+                    return True
+            except socket.error:
+                pass
+            finally:
+                sock.close()
+        return False
+
+    def wait_until_connected(self, timeout=None):
         """
         Wait until connections are being accepted.
 
+        :param timeout: The maximum number of seconds to wait (a number,
+                        defaults to :attr:`wait_timeout`).
         :raises: :exc:`TimeoutError` when the SSH server isn't fast enough to
                  initialize.
+
+        Connection attempts are made using :func:`attempt_connection()` and
+        refused connections are retried after 10 milliseconds, so that a
+        TCP server that starts listening is noticed almost immediately.
         """
         timer = Timer()
-        with Spinner(timer=timer) as spinner:
-            while not self.is_connected:
-                if timer.elapsed_time > self.wait_timeout:
+        # Look up the properties used in the loop below only once.
+        connect_timeout = self.connect_timeout
+        wait_timeout = self.wait_timeout if timeout is None else timeout
+        endpoint = self.endpoint
+        label = "Waiting for %s to accept connections" % endpoint
+        # Resolve the endpoint once (a socket can't be reused after a failed
+        # connection attempt, but the addresses to connect to can be).
+        addresses = self.resolve_endpoint() or None
+        # The spinner only renders when standard error is a terminal.
+        with Spinner(label=label, timer=timer) as spinner:
+            while not self.attempt_connection(addresses=addresses, timeout=min(
+                connect_timeout, max(0, wait_timeout - timer.elapsed_time),
+            )):
+                if timer.elapsed_time > wait_timeout:
                     raise TimeoutError(format(
                         "Failed to establish connection to %s within configured timeout of %s!",
-                        self.endpoint, format_timespan(self.wait_timeout),
+                        endpoint, format_timespan(wait_timeout),
                     ))
-                spinner.step(label="Waiting for %s to accept connections" % self.endpoint)
-                spinner.sleep()
-        logger.debug("Waited %s for %s to accept connections.", timer, self.endpoint)
+                spinner.step()
+                time.sleep(0.01)
+        logger.debug("Waited %s for %s to accept connections.", timer, endpoint)
 
 
 class EphemeralPortAllocator(WaitUntilConnected):
@@ -119,28 +188,102 @@ class EphemeralPortAllocator(WaitUntilConnected):
     """
     Allocate a free `ephemeral port number`_.
 
+    Allocated port numbers are reserved (see :attr:`reserved_ports`) until
+    :func:`release_port_number()` is called. You can use a :keyword:`with`
+    statement to release the port number automatically::
+
+        from executor.tcp import EphemeralPortAllocator
+
+        with EphemeralPortAllocator() as allocator:
+            start_server(allocator.port_number)
+
     .. _ephemeral port number: \
         http://en.wikipedia.org/wiki/List_of_TCP_and_UDP_port_numbers#Dynamic.2C_private_or_ephemeral_ports
     """
 
+    port_lock = threading.Lock()
+    """Serializes the allocation of port numbers between threads (a :class:`threading.Lock` object)."""
+
+    reserved_ports = set()
+    """The port numbers that have been allocated but not released yet (a :class:`set` of integers)."""
+
+    @mutable_property
+    def max_attempts(self):
+        """The maximum number of port numbers tried by :attr:`port_number` (an integer, defaults to 100)."""
+        return 100
+
+    @mutable_property
+    def reserved_port(self):
+        """
+        The port number reserved by :attr:`port_number` (an integer or :data:`None`).
+
+        This is :data:`None` until :attr:`port_number` allocates a port number
+        and again after :func:`release_port_number()` has been called.
+        """
+
     @lazy_property
     def port_number(self):
-        """A dynamically selected free ephemeral port number (an integer between 49152 and 65535)."""
+        """
+        A dynamically selected free ephemeral port number (an integer between 49152 and 65535).
+
+        The selected port number is added to :attr:`reserved_ports` so that
+        allocators running in parallel (e.g. in different threads) won't hand
+        out the same port number before the first server starts listening.
+        Callers are responsible for releasing the port number again using
+        :func:`release_port_number()` (or a :keyword:`with` statement),
+        otherwise it stays reserved for the lifetime of the process.
+
+        :raises: :exc:`PortAllocationError` when no free port number is found
+                 after :attr:`max_attempts` attempts.
+        """
         timer = Timer()
         logger.debug("Looking for free ephemeral port number ..")
-        for i in itertools.count(1):
+        for i in range(1, self.max_attempts + 1):
             value = self.ephemeral_port_number
+            # The lock is only held while claiming the port number, so that
+            # a slow connection attempt doesn't block other allocators.
+            with self.port_lock:
+                if value in self.reserved_ports:
+                    continue
+                self.reserved_ports.add(value)
             set_property(self, 'port_number', value)
             if not self.is_connected:
                 logger.debug("Found free ephemeral port number %s after %s (took %s).",
                              value, pluralize(i, "attempt"), timer)
+                self.reserved_port = value
                 return value
+            # The port number is in use, give up our claim.
+            with self.port_lock:
+                self.reserved_ports.discard(value)
+        # Don't leave the last (busy) port number behind in the
+        # property, otherwise the next access would return it.
+        clear_property(self, 'port_number')
+        raise PortAllocationError(format(
+            "Failed to find a free ephemeral port number after %s (took %s)!",
+            pluralize(self.max_attempts, "attempt"), timer,
+        ))
+
+    def release_port_number(self):
+        """Remove the port number allocated by :attr:`port_number` from :attr:`reserved_ports`."""
+        value = self.reserved_port
+        if value is not None:
+            with self.port_lock:
+                self.reserved_ports.discard(value)
+            self.reserved_port = None
 
     @property
     def ephemeral_port_number(self):
         """A random ephemeral port number (an integer between 49152 and 65535)."""
         return random.randint(49152, 65535)
 
+    def __enter__(self):
+        """Enable the use of :keyword:`with` statements (does nothing)."""
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Release the allocated port number (see :func:`release_port_number()`)."""
+        self.release_port_number()
+
 
 class EphemeralTCPServer(ExternalCommand, EphemeralPortAllocator):
 
@@ -182,6 +325,22 @@ class EphemeralTCPServer(ExternalCommand, EphemeralPortAllocator):
                 self.terminate()
                 raise
 
+    def cleanup(self):
+        """Release the allocated port number (see :func:`~EphemeralPortAllocator.release_port_number()`)."""
+        self.release_port_number()
+        super(EphemeralTCPServer, self).cleanup()
+
+
+class PortAllocationError(Exception):
+
+    """
+    Raised when no free ephemeral port number can be found.
+
+    This exception is raised by :attr:`~executor.tcp.EphemeralPortAllocator.port_number`
+    when :attr:`~executor.tcp.EphemeralPortAllocator.max_attempts` randomly
+    selected port numbers all turned out to be in use.
+    """
+
 
 class TimeoutError(Exception):
 
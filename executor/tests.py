@@ -1,7 +1,7 @@
 # Automated tests for the `executor' module.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: May 14, 2020
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -11,6 +11,10 @@ This test suite uses ``sudo`` in several tests. If you don't have passwordless
 sudo configured you'll notice because you'll get interactive prompts when
 running the test suite ...
 
+Because of this the tests that use ``sudo`` are skipped unless the environment
+variable ``$EXECUTOR_RUN_SUDO_TESTS`` is set to ``true``. The same goes for the
+tests that use ``fakeroot`` and ``$EXECUTOR_RUN_FAKEROOT_TESTS``.
+
 Of course the idea behind a test suite is to run non-interactively, so in my
 personal development environment I have added a custom sudo configuration file
 ``/etc/sudoers.d/executor-test-suite`` with the following contents::
@@ -38,7 +42,8 @@ locations of the executables whose pathnames have been expanded in the sudo
 configuration. Happy testing!
 
 By the way none of this is relevant on e.g. Travis CI because in that
-environment passwordless sudo access has been configured.
+environment passwordless sudo access has been configured (and the environment
+variables mentioned above are set in ``.travis.yml``).
 """
 
 # Standard library modules.
@@ -48,6 +53,7 @@ import os
 import pwd
 import random
 import shlex
+import shutil
 import socket
 import sys
 import tempfile
@@ -56,7 +62,13 @@ import uuid
 
 # External dependencies.
 from humanfriendly import Timer, coerce_boolean
-from humanfriendly.testing import MockedProgram, TemporaryDirectory, TestCase, retry, run_cli
+from humanfriendly.testing import (
+    MockedProgram,
+    TestCase,
+    configure_logging,
+    retry,
+    run_cli,
+)
 from humanfriendly.text import compact, dedent
 from mock import MagicMock
 from property_manager import set_property
@@ -110,9 +122,37 @@ class ExecutorTestCase(TestCase):
 
     """Container for the `executor` test suite."""
 
+    other_user = None
+    """The password database entry returned by :func:`get_other_user()` (cached on first use)."""
+
+    ssh_server = None
+    """The :class:`.SSHServer` shared by the tests that need one (started on first use)."""
+
+    sudo_available = None
+    """Whether ``sudo`` works without a password (checked by :func:`require_sudo()` on first use)."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Configure logging, create a temporary directory and check whether ``fakeroot`` is installed."""
+        super(ExecutorTestCase, cls).setUpClass()
+        configure_logging(logging.DEBUG)
+        # Create a temporary directory that's shared by the tests (each test
+        # creates uniquely named files and directories inside it).
+        cls.temporary_directory = tempfile.mkdtemp(prefix='executor-', suffix='-tests')
+        # Check once whether fakeroot is available.
+        cls.fakeroot_available = bool(which('fakeroot'))
+
+    @classmethod
+    def tearDownClass(cls):
+        """Shut down the SSH server (if it was started) and remove the temporary directory."""
+        if cls.ssh_server is not None:
+            cls.ssh_server.__exit__()
+            cls.ssh_server = None
+        shutil.rmtree(cls.temporary_directory)
+        super(ExecutorTestCase, cls).tearDownClass()
+
     def setUp(self):
         """Set up logging for subprocesses and initialize test directories."""
-        # Set up our superclass.
         super(ExecutorTestCase, self).setUp()
         # Enable verbose logging to the terminal for subprocesses.
         os.environ['COLOREDLOGS_LOG_LEVEL'] = 'DEBUG'
@@ -121,6 +161,98 @@ class ExecutorTestCase(TestCase):
         if not os.path.isdir(self.sudo_enabled_directory):
             os.makedirs(self.sudo_enabled_directory)
 
+    def get_other_user(self):
+        """
+        Find a user account that is not root and not the current user.
+
+        :returns: A :data:`pwd.struct_passwd` object.
+
+        Scanning the password database can be slow (e.g. when it's backed by
+        LDAP) so the ``nobody`` account is tried first, the complete password
+        database is only scanned when that fails and the result is shared by
+        all tests.
+        """
+        cls = type(self)
+        if cls.other_user is None:
+            uids_to_ignore = (0, os.getuid())
+            try:
+                entry = pwd.getpwnam('nobody')
+                if entry.pw_uid not in uids_to_ignore:
+                    cls.other_user = entry
+            except KeyError:
+                pass
+            if cls.other_user is None:
+                cls.other_user = next(e for e in pwd.getpwall() if e.pw_uid not in uids_to_ignore)
+        return cls.other_user
+
+    def get_ssh_server(self):
+        """
+        Get an SSH server that remote commands can connect to.
+
+        :returns: A running :class:`.SSHServer` object.
+
+        Generating host and client keys and waiting for the SSH server to start
+        accepting connections takes a while, so the server is started once and
+        shared by all tests (see :func:`tearDownClass()`).
+        """
+        cls = type(self)
+        if cls.ssh_server is None:
+            server = SSHServer()
+            try:
+                server.start()
+            except Exception:
+                server.cleanup()
+                raise
+            cls.ssh_server = server
+        return cls.ssh_server
+
+    def require_opt_in(self, variable):
+        """Skip the current test unless the environment variable `variable` is set to ``true``."""
+        if not coerce_boolean(os.environ.get(variable, 'false')):
+            self.skipTest("set $%s=true to enable this test" % variable)
+
+    def require_fakeroot(self):
+        """Skip the current test unless ``fakeroot`` tests are enabled and ``fakeroot`` is installed."""
+        self.require_opt_in('EXECUTOR_RUN_FAKEROOT_TESTS')
+        if not self.fakeroot_available:
+            self.skipTest("fakeroot is not installed")
+
+    def require_sudo(self):
+        """Skip the current test unless ``sudo`` tests are enabled and ``sudo`` works without a password."""
+        self.require_opt_in('EXECUTOR_RUN_SUDO_TESTS')
+        # Only run `sudo' after the tests were enabled, because a failing
+        # `sudo -l' is logged (and possibly mailed to the administrator).
+        cls = type(self)
+        if cls.sudo_available is None:
+            cls.sudo_available = bool(which('sudo')) and execute('sudo', '-n', '-l', check=False, silent=True)
+        if not cls.sudo_available:
+            self.skipTest("sudo is not installed or requires a password")
+
+    def create_temporary_file(self, suffix):
+        """
+        Create a temporary file inside the temporary directory of the test suite.
+
+        :param suffix: The suffix of the filename (a string).
+        :returns: The pathname of the temporary file (a string).
+
+        The file is removed together with the temporary directory by
+        :func:`tearDownClass()`.
+        """
+        fd, filename = tempfile.mkstemp(prefix='executor-', suffix=suffix, dir=self.temporary_directory)
+        os.close(fd)
+        return filename
+
+    def create_temporary_directory(self):
+        """
+        Create a directory inside the temporary directory of the test suite.
+
+        :returns: The pathname of the directory (a string).
+
+        The directory is removed together with the temporary directory by
+        :func:`tearDownClass()`.
+        """
+        return tempfile.mkdtemp(prefix='executor-', dir=self.temporary_directory)
+
     def test_async_compat(self):
         """Make sure the ``async`` property still works (backwards compatibility)."""
         aliases = ('async', 'asynchronous')
@@ -258,12 +390,11 @@ class ExecutorTestCase(TestCase):
     def test_remote_commands_on_stdin(self):
         """Test that callers can opt in to shell evaluation for remote commands given on standard input."""
         random_string = uuid.uuid4().hex
-        with SSHServer() as server:
-            output = remote('127.0.0.1',
-                            capture=True, shell=True,
-                            input='echo %s' % quote(random_string),
-                            **server.client_options)
-            assert output == random_string
+        output = remote('127.0.0.1',
+                        capture=True, shell=True,
+                        input='echo %s' % quote(random_string),
+                        **self.get_ssh_server().client_options)
+        assert output == random_string
 
     def test_stdin(self):
         """Make sure standard input can be provided to external commands."""
@@ -277,7 +408,7 @@ class ExecutorTestCase(TestCase):
         # way without creating the largest test in this test suite :-). The
         # least I can do is make sure the keyword argument is accepted and the
         # code runs without exceptions in supported environments.
-        assert execute('echo', 'this is a test', silent=True) is True
+        assert execute('true', silent=True) is True
 
     def test_stderr(self):
         """Make sure standard error of external commands can be captured."""
@@ -312,29 +443,29 @@ class ExecutorTestCase(TestCase):
 
     def test_stdout_to_file(self):
         """Make sure the standard output stream of external commands can be redirected and appended to a file."""
-        fd, filename = tempfile.mkstemp(prefix='executor-', suffix='-stdout.txt')
-        with open(filename, 'w') as handle:
+        filename = self.create_temporary_file('-stdout.txt')
+        with open(filename, 'a+') as handle:
             handle.write('existing contents\n')
-        with open(filename, 'a') as handle:
-            execute('echo appended output', stdout_file=handle)
-        # Make sure the file was _not_ removed.
-        assert os.path.isfile(filename)
-        # Make sure the output was appended.
-        with open(filename) as handle:
+            handle.flush()
+            execute('echo', 'appended output', stdout_file=handle)
+            # Make sure the file was _not_ removed.
+            assert os.path.isfile(filename)
+            # Make sure the output was appended.
+            handle.seek(0)
             lines = [line.strip() for line in handle]
         assert lines == ['existing contents', 'appended output']
 
     def test_stderr_to_file(self):
         """Make sure the standard error stream of external commands can be redirected and appended to a file."""
-        fd, filename = tempfile.mkstemp(prefix='executor-', suffix='-stderr.txt')
-        with open(filename, 'w') as handle:
+        filename = self.create_temporary_file('-stderr.txt')
+        with open(filename, 'a+') as handle:
             handle.write('existing contents\n')
-        with open(filename, 'a') as handle:
+            handle.flush()
             execute('echo appended output 1>&2', stderr_file=handle)
-        # Make sure the file was _not_ removed.
-        assert os.path.isfile(filename)
-        # Make sure the output was appended.
-        with open(filename) as handle:
+            # Make sure the file was _not_ removed.
+            assert os.path.isfile(filename)
+            # Make sure the output was appended.
+            handle.seek(0)
             lines = [line.strip() for line in handle]
         assert lines == ['existing contents', 'appended output']
 
@@ -352,41 +483,41 @@ class ExecutorTestCase(TestCase):
 
     def test_merged_streams_to_file(self):
         """Make sure the standard streams of external commands can be merged, redirected and appended to a file."""
-        fd, filename = tempfile.mkstemp(prefix='executor-', suffix='-merged.txt')
-        with open(filename, 'w') as handle:
+        filename = self.create_temporary_file('-merged.txt')
+        with open(filename, 'a+') as handle:
             handle.write('existing contents\n')
-        with open(filename, 'a') as handle:
+            handle.flush()
             execute('echo standard output; echo standard error 1>&2', stdout_file=handle, stderr_file=handle)
-        # Make sure the file was _not_ removed.
-        assert os.path.isfile(filename)
-        # Make sure the output was appended.
-        with open(filename) as handle:
+            # Make sure the file was _not_ removed.
+            assert os.path.isfile(filename)
+            # Make sure the output was appended.
+            handle.seek(0)
             lines = [line.strip() for line in handle]
         assert lines == ['existing contents', 'standard output', 'standard error']
 
     def test_asynchronous_stream_to_file(self):
         """Make sure the standard streams can be redirected to a file and asynchronously stream output to that file."""
-        fd, filename = tempfile.mkstemp(prefix='executor-', suffix='-streaming.txt')
+        filename = self.create_temporary_file('-streaming.txt')
         with open(filename, 'w') as handle:
             cmd = ExternalCommand('for ((i=0; i<25; i++)); do echo $i; sleep 0.1; done',
                                   asynchronous=True, stdout_file=handle)
             cmd.start()
 
-        def expect_some_output():
-            """Expect some but not all output to be readable at some point."""
-            with open(filename) as handle:
-                lines = list(handle)
+        # Open the file only once and rewind it before every check.
+        with open(filename) as reader:
+
+            def expect_some_output():
+                """Expect some but not all output to be readable at some point."""
+                reader.seek(0)
+                lines = reader.readlines()
                 assert len(lines) > 0
                 assert len(lines) < 25
 
-        def expect_all_output():
-            """Expect all output to be readable at some point."""
-            with open(filename) as handle:
-                lines = list(handle)
-                assert len(lines) == 25
-
-        retry(expect_some_output, 10)
-        retry(expect_all_output, 20)
+            retry(expect_some_output, 10)
+            # Block until the command finishes instead of polling for the rest of its output.
+            cmd.wait()
+            reader.seek(0)
+            assert len(reader.readlines()) == 25
 
     def test_asynchronous_unbuffered_output(self):
         """Make sure output buffering to temporary files can be disabled."""
@@ -425,41 +556,50 @@ class ExecutorTestCase(TestCase):
 
     def test_working_directory(self):
         """Make sure the working directory of external commands can be set."""
-        with TemporaryDirectory() as directory:
-            self.assertEqual(execute('echo $PWD', capture=True, directory=directory), directory)
+        directory = self.create_temporary_directory()
+        self.assertEqual(execute('pwd', capture=True, directory=directory), directory)
 
     def test_virtual_environment_option(self):
         """Make sure Python virtual environments can be used."""
-        with TemporaryDirectory() as directory:
-            virtual_environment = os.path.join(directory, 'environment')
-            # Create a virtual environment to run the command in.
+        directory = self.create_temporary_directory()
+        virtual_environment = os.path.join(directory, 'environment')
+        # Create a virtual environment to run the command in. On Python 3 we
+        # use the built-in venv module without pip because that's a lot faster
+        # than the external virtualenv program (and we don't need pip).
+        if sys.version_info[0] >= 3:
+            execute(sys.executable, '-m', 'venv', '--without-pip', virtual_environment)
+        else:
             execute('virtualenv', virtual_environment)
-            # This is the expected value of `sys.executable'.
-            expected_executable = os.path.join(virtual_environment, 'bin', 'python')
-            # Get the actual value of `sys.executable' by running a Python
-            # interpreter inside the virtual environment.
-            actual_executable = execute('python', '-c', 'import sys; print(sys.executable)',
-                                        capture=True, virtual_environment=virtual_environment)
-            # Make sure the values match.
-            assert os.path.samefile(expected_executable, actual_executable)
-            # Make sure that shell commands are also supported (command line
-            # munging inside executor is a bit tricky and I specifically got
-            # this wrong on the first attempt :-).
-            output = execute('echo $VIRTUAL_ENV', capture=True, virtual_environment=virtual_environment)
-            assert os.path.samefile(virtual_environment, output)
+        # This is the expected value of `sys.executable'.
+        expected_executable = os.path.join(virtual_environment, 'bin', 'python')
+        # Get the actual value of `sys.executable' by running a Python
+        # interpreter inside the virtual environment.
+        actual_executable = execute('python', '-c', 'import sys; print(sys.executable)',
+                                    capture=True, virtual_environment=virtual_environment)
+        # Make sure the values match.
+        assert os.path.samefile(expected_executable, actual_executable)
+        # Make sure that shell commands are also supported (command line
+        # munging inside executor is a bit tricky and I specifically got
+        # this wrong on the first attempt :-).
+        output = execute('echo $VIRTUAL_ENV', capture=True, virtual_environment=virtual_environment)
+        assert os.path.samefile(virtual_environment, output)
 
     def test_fakeroot_option(self):
         """Make sure ``fakeroot`` can be used."""
-        filename = os.path.join(tempfile.gettempdir(), 'executor-%s-fakeroot-test' % os.getpid())
-        self.assertTrue(execute('touch', filename, fakeroot=True))
-        try:
-            self.assertTrue(execute('chown', 'root:root', filename, fakeroot=True))
-            self.assertEqual(execute('stat', '--format=%U', filename, fakeroot=True, capture=True), 'root')
-            self.assertEqual(execute('stat', '--format=%G', filename, fakeroot=True, capture=True), 'root')
-            self.assertTrue(execute('chmod', '600', filename, fakeroot=True))
-            self.assertEqual(execute('stat', '--format=%a', filename, fakeroot=True, capture=True), '600')
-        finally:
-            os.unlink(filename)
+        self.require_fakeroot()
+        filename = self.create_temporary_file('-fakeroot-test')
+        # Run all of the commands in a single fakeroot session instead of
+        # spawning a separate fakeroot process for every command.
+        shell_command = ' && '.join(c + ' ' + quote(filename) for c in (
+            'touch',
+            'chown root:root',
+            'stat --format=%U',
+            'stat --format=%G',
+            'chmod 600',
+            'stat --format=%a',
+        ))
+        output = execute(shell_command, fakeroot=True, capture=True)
+        self.assertEqual(output.splitlines(), ['root', 'root', '600'])
 
     def test_uid_option(self):
         """
@@ -470,8 +610,11 @@ class ExecutorTestCase(TestCase):
         written this way because I wanted to make the least possible
         assumptions about the systems that will run this test suite.
         """
-        uids_to_ignore = (0, os.getuid())
-        entry = next(e for e in pwd.getpwall() if e.pw_uid not in uids_to_ignore)
+        # Unlike the `sudo' option (see test_sudo_option()) the `uid' and
+        # `user' options always use `sudo -u', even when we're running as
+        # root, so we can't skip the check for superuser privileges here.
+        self.require_sudo()
+        entry = self.get_other_user()
         output = execute('id', '-u', capture=True, uid=entry.pw_uid)
         assert output == str(entry.pw_uid)
 
@@ -484,14 +627,22 @@ class ExecutorTestCase(TestCase):
         written this way because I wanted to make the least possible
         assumptions about the systems that will run this test suite.
         """
-        uids_to_ignore = (0, os.getuid())
-        entry = next(e for e in pwd.getpwall() if e.pw_uid not in uids_to_ignore)
+        # Unlike the `sudo' option (see test_sudo_option()) the `uid' and
+        # `user' options always use `sudo -u', even when we're running as
+        # root, so we can't skip the check for superuser privileges here.
+        self.require_sudo()
+        entry = self.get_other_user()
         output = execute('id', '-u', capture=True, user=entry.pw_name)
         assert output == str(entry.pw_uid)
 
     def test_sudo_option(self):
         """Make sure ``sudo`` can be used to elevate privileges."""
-        filename = os.path.join(self.sudo_enabled_directory, 'executor-%s-sudo-test' % os.getpid())
+        self.require_opt_in('EXECUTOR_RUN_SUDO_TESTS')
+        # The `sudo' option is ignored when we already have superuser
+        # privileges, so we only need a working `sudo' when we're not root.
+        if os.getuid() != 0:
+            self.require_sudo()
+        filename = os.path.join(self.sudo_enabled_directory, 'executor-%s-sudo-test' % uuid.uuid4().hex)
         self.assertTrue(execute('touch', filename))
         try:
             self.assertTrue(execute('chown', 'root:root', filename, sudo=True))
@@ -530,29 +681,28 @@ class ExecutorTestCase(TestCase):
 
     def test_environment_variable_handling(self):
         """Make sure environment variables can be overridden."""
-        # Check that environment variables of the current process are passed on to subprocesses.
-        output = execute('echo $PATH', capture=True)
-        assert output == os.environ['PATH']
-        # Test that environment variable overrides can be given to external commands.
+        # Check that environment variables of the current process are passed
+        # on to subprocesses and that environment variable overrides can be
+        # given to external commands (using a single subprocess).
         output = execute(
-            'echo $HELLO $WORLD',
+            'printenv', 'PATH', 'HELLO', 'WORLD',
             capture=True,
             environment=dict(
                 HELLO='Hello',
                 WORLD='world!',
             ),
         )
-        assert output == 'Hello world!'
+        assert output.splitlines() == [os.environ['PATH'], 'Hello', 'world!']
         # Test that the environment variables of a command can be modified
         # after the command has been initialized.
-        cmd = ExternalCommand('echo $DELAYED', capture=True)
+        cmd = ExternalCommand('printenv', 'DELAYED', capture=True)
         cmd.environment['DELAYED'] = 'Also works fine'
         cmd.wait()
         assert cmd.output == 'Also works fine'
 
     def test_simple_asynchronous_cmd(self):
         """Make sure commands can be executed asynchronously."""
-        cmd = ExternalCommand('sleep 4', asynchronous=True)
+        cmd = ExternalCommand('sleep', '1', asynchronous=True)
         # Make sure we're starting from a sane state.
         assert not cmd.was_started
         assert not cmd.is_running
@@ -572,7 +722,7 @@ class ExecutorTestCase(TestCase):
             assert cmd.is_running
             assert not cmd.is_finished
 
-        retry(assert_running, timeout=4)
+        retry(assert_running, timeout=1)
         # Wait for the external command to finish.
         cmd.wait()
         # Make sure we finished in a sane state.
@@ -581,45 +731,29 @@ class ExecutorTestCase(TestCase):
         assert cmd.is_finished
         assert cmd.returncode == 0
 
-    def test_asynchronous_with_input(self):
-        """Make sure asynchronous commands can be provided standard input."""
-        random_file = os.path.join(tempfile.gettempdir(), 'executor-%s-asynchronous-input-test' % os.getpid())
-        random_value = str(random.random())
-        cmd = ExternalCommand('cat > %s' % quote(random_file), asynchronous=True, input=random_value)
-        try:
-            cmd.start()
-            cmd.wait()
-            assert os.path.isfile(random_file)
-            with open(random_file) as handle:
-                contents = handle.read()
-                assert random_value == contents.strip()
-        finally:
-            if os.path.isfile(random_file):
-                os.unlink(random_file)
-
-    def test_asynchronous_with_output(self):
-        """Make sure asynchronous command output can be captured."""
+    def test_asynchronous_with_input_and_output(self):
+        """Make sure asynchronous commands can be provided standard input and their output can be captured."""
         random_value = str(random.random())
-        cmd = ExternalCommand('echo %s' % quote(random_value), asynchronous=True, capture=True)
+        cmd = ExternalCommand('cat', asynchronous=True, capture=True, input=random_value)
         cmd.start()
         cmd.wait()
         assert cmd.output == random_value
 
     def test_callback_evaluation(self):
         """Make sure result processing callbacks work as expected."""
-        result = execute('echo', str(time.time()), callback=self.coerce_timestamp)
-        assert isinstance(result, datetime.datetime)
+        result = execute('echo', '1700000000', callback=self.coerce_timestamp)
+        assert result == datetime.datetime.fromtimestamp(1700000000)
 
     def coerce_timestamp(self, cmd):
         """Callback for :func:`test_callback_evaluation()`."""
-        return datetime.datetime.fromtimestamp(float(cmd.output))
+        return datetime.datetime.fromtimestamp(int(cmd.output))
 
     def test_event_callbacks(self):
         """Make sure the ``start_event`` and ``finish_event`` callbacks are actually invoked."""
         for asynchronous in True, False:
             results = []
             cmd = ExternalCommand(
-                'sleep', '0.1',
+                'true',
                 asynchronous=asynchronous,
                 start_event=lambda cmd: results.append(('started', time.time())),
                 finish_event=lambda cmd: results.append(('finished', time.time())),
@@ -649,32 +783,28 @@ class ExecutorTestCase(TestCase):
         assert 'is_running=False' in repr(cmd)
         assert 'is_finished=False' in repr(cmd)
         cmd.start()
-
-        def assert_finished():
-            """Allow for some delay before the external command finishes."""
-            assert 'was_started=True' in repr(cmd)
-            assert 'is_running=False' in repr(cmd)
-            assert 'is_finished=True' in repr(cmd)
-
-        retry(assert_finished, 10)
+        cmd.wait()
+        assert 'was_started=True' in repr(cmd)
+        assert 'is_running=False' in repr(cmd)
+        assert 'is_finished=True' in repr(cmd)
 
     def test_retry(self):
         """Check that failing commands can be retried until they succeed."""
-        with TemporaryDirectory() as directory:
-            script = self.create_retry_script(directory, 5)
-            cmd = ExternalCommand(script, retry=True, retry_limit=10, shell=False)
-            cmd.start()
-            assert cmd.retry_count == 4
-            assert cmd.returncode == 0
+        directory = self.create_temporary_directory()
+        script = self.create_retry_script(directory, 5)
+        cmd = ExternalCommand(script, retry=True, retry_limit=10, shell=False)
+        cmd.start()
+        assert cmd.retry_count == 4
+        assert cmd.returncode == 0
 
     def test_retry_limit(self):
         """Check that failing commands aren't retried indefinitely."""
-        with TemporaryDirectory() as directory:
-            script = self.create_retry_script(directory, 5)
-            cmd = ExternalCommand(script, check=False, retry=True, retry_limit=2, shell=False)
-            cmd.start()
-            assert cmd.retry_count == 2
-            assert cmd.returncode == 42
+        directory = self.create_temporary_directory()
+        script = self.create_retry_script(directory, 5)
+        cmd = ExternalCommand(script, check=False, retry=True, retry_limit=2, shell=False)
+        cmd.start()
+        assert cmd.retry_count == 2
+        assert cmd.returncode == 42
 
     def create_retry_script(self, directory, iterations=2):
         """Create a script that fails until the fifth run :-)."""
@@ -698,11 +828,11 @@ class ExecutorTestCase(TestCase):
 
     def test_command_pool(self):
         """Make sure command pools actually run multiple commands in parallel."""
-        num_commands = 10
-        sleep_time = 4
+        num_commands = 8
+        sleep_time = 1
         pool = CommandPool(5)
         for i in range(num_commands):
-            pool.add(ExternalCommand('sleep %i' % sleep_time))
+            pool.add(ExternalCommand('sleep', str(sleep_time)))
         timer = Timer()
         results = pool.run()
         assert all(cmd.returncode == 0 for cmd in results.values())
@@ -710,7 +840,9 @@ class ExecutorTestCase(TestCase):
 
     def test_command_pool_resumable(self):
         """Make sure command pools can be resumed after raising exceptions."""
-        pool = CommandPool()
+        # The concurrency is fixed so that a single call to spawn() starts
+        # both commands, regardless of the number of CPU cores available.
+        pool = CommandPool(concurrency=2)
         # Prepare two commands that will both raise an exception.
         c1 = ExternalCommand('exit 1', check=True)
         c2 = ExternalCommand('exit 42', check=True)
@@ -718,9 +850,11 @@ class ExecutorTestCase(TestCase):
         pool.add(c1)
         pool.add(c2)
         pool.spawn()
-        # Wait for both commands to finish.
-        while not pool.is_finished:
-            time.sleep(0.1)
+        # Wait for both commands to finish. We block in waitpid() on the
+        # subprocess.Popen objects because ExternalCommand.wait() would
+        # check for errors, and that's what collect() is supposed to do.
+        for cmd in (c1, c2):
+            cmd.subprocess.wait()
         # The first call to collect() should raise an exception about `exit 1'.
         e1 = intercept(ExternalCommandFailed, pool.collect)
         assert e1.command is c1
@@ -730,48 +864,48 @@ class ExecutorTestCase(TestCase):
 
     def test_command_pool_retry(self):
         """Make sure command pools can retry failing commands."""
-        with TemporaryDirectory() as directory:
-            pool = CommandPool(concurrency=2, delay_checks=True)
-            # Create a shell script that succeeds on the second run and retry
-            # it exactly once. We expect this command to have succeeded when
-            # the command pool is finished.
-            script_1 = self.create_retry_script(directory, 2)
-            command_1 = ExternalCommand(script_1, asynchronous=True, retry=True, retry_limit=1)
-            pool.add(command_1)
-            # Create a shell script that succeeds on the fourth run and retry
-            # it up to two times. We expect this command to have failed when
-            # the command pool is finished.
-            script_2 = self.create_retry_script(directory, 4)
-            command_2 = ExternalCommand(script_2, asynchronous=True, retry=True, retry_limit=2)
-            pool.add(command_2)
-            # Include a command without retries that succeeds.
-            command_3 = ExternalCommand('true', asynchronous=True, retry=False)
-            pool.add(command_3)
-            # Include a command without retries that fails.
-            command_4 = ExternalCommand('false', asynchronous=True, retry=False)
-            pool.add(command_4)
-            # Run the commands in the pool, expecting an `CommandPoolFailed'
-            # exception because the second command will fail despite retrying
-            # and the fourth command fails on its first and only run.
-            self.assertRaises(CommandPoolFailed, pool.run)
-            # Check that the first command succeeded (with a retry).
-            assert command_1.succeeded
-            assert command_1.retry_count == 1
-            # Check that the second command failed (with retries).
-            assert command_2.failed
-            assert command_2.retry_count == 2
-            # Check that the third command succeeded (without retries).
-            assert command_3.succeeded
-            assert command_3.retry_count == 0
-            # Check that the fourth command failed (without retries).
-            assert command_4.failed
-            assert command_4.retry_count == 0
+        directory = self.create_temporary_directory()
+        pool = CommandPool(concurrency=2, delay_checks=True)
+        # Create a shell script that succeeds on the second run and retry
+        # it exactly once. We expect this command to have succeeded when
+        # the command pool is finished.
+        script_1 = self.create_retry_script(directory, 2)
+        command_1 = ExternalCommand(script_1, asynchronous=True, retry=True, retry_limit=1)
+        pool.add(command_1)
+        # Create a shell script that succeeds on the fourth run and retry
+        # it up to two times. We expect this command to have failed when
+        # the command pool is finished.
+        script_2 = self.create_retry_script(directory, 4)
+        command_2 = ExternalCommand(script_2, asynchronous=True, retry=True, retry_limit=2)
+        pool.add(command_2)
+        # Include a command without retries that succeeds.
+        command_3 = ExternalCommand('true', asynchronous=True, retry=False)
+        pool.add(command_3)
+        # Include a command without retries that fails.
+        command_4 = ExternalCommand('false', asynchronous=True, retry=False)
+        pool.add(command_4)
+        # Run the commands in the pool, expecting an `CommandPoolFailed'
+        # exception because the second command will fail despite retrying
+        # and the fourth command fails on its first and only run.
+        self.assertRaises(CommandPoolFailed, pool.run)
+        # Check that the first command succeeded (with a retry).
+        assert command_1.succeeded
+        assert command_1.retry_count == 1
+        # Check that the second command failed (with retries).
+        assert command_2.failed
+        assert command_2.retry_count == 2
+        # Check that the third command succeeded (without retries).
+        assert command_3.succeeded
+        assert command_3.retry_count == 0
+        # Check that the fourth command failed (without retries).
+        assert command_4.failed
+        assert command_4.retry_count == 0
 
     def test_command_pool_termination(self):
         """Make sure command pools can be terminated on failure."""
-        pool = CommandPool()
+        pool = CommandPool(concurrency=2)
         # Include a command that just sleeps for a minute.
-        sleep_cmd = ExternalCommand('sleep 60')
+        sleep_cmd = ExternalCommand('sleep', '60')
         pool.add(sleep_cmd)
         # Include a command that immediately exits with a nonzero return code.
         pool.add(ExternalCommand('exit 1', check=True))
@@ -792,9 +926,9 @@ class ExecutorTestCase(TestCase):
         # Include a command that fails immediately.
         pool.add(ExternalCommand('exit 1', check=True))
         # Include some commands that just sleep for a while.
-        pool.add(ExternalCommand('sleep 1', check=True))
-        pool.add(ExternalCommand('sleep 2', check=True))
-        pool.add(ExternalCommand('sleep 3', check=True))
+        pool.add(ExternalCommand('sleep', '0.3', check=True))
+        pool.add(ExternalCommand('sleep', '0.5', check=True))
+        pool.add(ExternalCommand('sleep', '0.7', check=True))
         # Make sure the expected exception is raised.
         self.assertRaises(CommandPoolFailed, pool.run)
         # Make sure all commands were started.
@@ -814,27 +948,27 @@ class ExecutorTestCase(TestCase):
 
     def test_command_pool_logs_directory(self):
         """Make sure command pools can log output of commands in a directory."""
-        with TemporaryDirectory() as root_directory:
-            identifiers = [1, 2, 3, 4, 5]
-            sub_directory = os.path.join(root_directory, 'does-not-exist-yet')
-            pool = CommandPool(concurrency=5, logs_directory=sub_directory)
-            for i in identifiers:
-                pool.add(identifier=i, command=ExternalCommand('echo %i' % i))
-            pool.run()
-            files = os.listdir(sub_directory)
-            assert sorted(files) == sorted(['%s.log' % i for i in identifiers])
-            for filename in files:
-                with open(os.path.join(sub_directory, filename)) as handle:
-                    contents = handle.read()
-                assert filename == ('%s.log' % contents.strip())
+        root_directory = self.create_temporary_directory()
+        identifiers = [1, 2, 3, 4, 5]
+        sub_directory = os.path.join(root_directory, 'does-not-exist-yet')
+        pool = CommandPool(concurrency=5, logs_directory=sub_directory)
+        for i in identifiers:
+            pool.add(identifier=i, command=ExternalCommand('echo', str(i)))
+        pool.run()
+        files = os.listdir(sub_directory)
+        assert sorted(files) == sorted('%s.log' % i for i in identifiers)
+        for filename in files:
+            with open(os.path.join(sub_directory, filename)) as handle:
+                contents = handle.read()
+            assert filename == ('%s.log' % contents.strip())
 
     def test_concurrency_control_with_groups(self):
         """Make sure command pools support ``group_by`` for high level concurrency control."""
         pool = CommandPool(concurrency=10)
         for i in range(10):
-            pool.add(ExternalCommand('sleep 0.1', group_by='group-a'))
+            pool.add(ExternalCommand('sleep', '0.1', group_by='group-a'))
         for i in range(10):
-            pool.add(ExternalCommand('sleep 0.1', group_by='group-b'))
+            pool.add(ExternalCommand('sleep', '0.1', group_by='group-b'))
         while not pool.is_finished:
             pool.spawn()
             # Make sure we never see more than two commands running at the same
@@ -845,9 +979,9 @@ class ExecutorTestCase(TestCase):
     def test_concurrency_control_with_dependencies(self):
         """Make sure command pools support ``dependencies`` for low level concurrency control."""
         pool = CommandPool(concurrency=10)
-        group_one = [ExternalCommand('sleep 0.1') for i in range(5)]
-        group_two = [ExternalCommand('sleep 0.1', dependencies=group_one) for i in range(5)]
-        group_three = [ExternalCommand('sleep 0.1', dependencies=group_two) for i in range(5)]
+        group_one = [ExternalCommand('sleep', '0.1') for i in range(5)]
+        group_two = [ExternalCommand('sleep', '0.1', dependencies=group_one) for i in range(5)]
+        group_three = [ExternalCommand('sleep', '0.1', dependencies=group_two) for i in range(5)]
         for group in group_one, group_two, group_three:
             for cmd in group:
                 pool.add(cmd)
@@ -887,6 +1021,14 @@ class ExecutorTestCase(TestCase):
         # Make sure the connection timeout can be configured.
         assert 'ConnectTimeout=42' in \
             RemoteCommand('localhost', 'date', connect_timeout=42).command_line
+        # Make sure connection multiplexing is disabled by default.
+        assert not any(token.startswith('Control') for token in
+                       RemoteCommand('localhost', 'date').command_line)
+        # Make sure connection multiplexing can be enabled.
+        command_line = RemoteCommand('localhost', 'date', multiplex=True,
+                                     control_path='/some/socket').command_line
+        for token in 'ControlMaster=auto', 'ControlPath=/some/socket', 'ControlPersist=60s':
+            assert token in command_line
         # Make sure the SSH client program command can be configured.
         assert 'Compression=yes' in \
             RemoteCommand('localhost', 'date', ssh_command=['ssh', '-o', 'Compression=yes']).command_line
@@ -926,50 +1068,45 @@ class ExecutorTestCase(TestCase):
 
     def test_remote_command_missing(self):
         """Make sure a specific exception is raised when a remote command is missing."""
-        with SSHServer() as server:
-            self.assertRaises(
-                RemoteCommandNotFound,
-                remote, '127.0.0.1', MISSING_COMMAND,
-                **server.client_options
-            )
+        self.assertRaises(
+            RemoteCommandNotFound,
+            remote, '127.0.0.1', MISSING_COMMAND,
+            **self.get_ssh_server().client_options
+        )
 
     def test_remote_working_directory(self):
         """Make sure remote working directories can be set."""
-        with SSHServer() as server:
-            with TemporaryDirectory() as some_random_directory:
-                output = remote('127.0.0.1', 'pwd',
-                                capture=True,
-                                directory=some_random_directory,
-                                **server.client_options)
-                assert output == some_random_directory
+        some_random_directory = self.create_temporary_directory()
+        output = remote('127.0.0.1', 'pwd',
+                        capture=True,
+                        directory=some_random_directory,
+                        **self.get_ssh_server().client_options)
+        assert output == some_random_directory
 
     def test_remote_error_handling(self):
         """Make sure remote commands preserve exit codes."""
-        with SSHServer() as server:
-            cmd = RemoteCommand('127.0.0.1', 'exit 42', **server.client_options)
-            self.assertRaises(RemoteCommandFailed, cmd.start)
+        cmd = RemoteCommand('127.0.0.1', 'exit 42', **self.get_ssh_server().client_options)
+        self.assertRaises(RemoteCommandFailed, cmd.start)
 
     def test_foreach(self):
         """Make sure remote command pools work."""
-        with SSHServer() as server:
-            ssh_aliases = ['127.0.0.%i' % i for i in (1, 2, 3, 4, 5, 6, 7, 8)]
-            results = foreach(ssh_aliases, 'echo $SSH_CONNECTION',
-                              concurrency=3, capture=True,
-                              **server.client_options)
-            assert sorted(ssh_aliases) == sorted(cmd.ssh_alias for cmd in results)
-            assert len(ssh_aliases) == len(set(cmd.output for cmd in results))
+        ssh_aliases = ['127.0.0.%i' % i for i in (1, 2, 3, 4, 5, 6, 7, 8)]
+        results = foreach(ssh_aliases, 'echo $SSH_CONNECTION',
+                          concurrency=3, capture=True,
+                          **self.get_ssh_server().client_options)
+        assert sorted(ssh_aliases) == sorted(cmd.ssh_alias for cmd in results)
+        assert len(ssh_aliases) == len(set(cmd.output for cmd in results))
 
     def test_foreach_with_logging(self):
         """Make sure remote command pools can log output."""
-        with TemporaryDirectory() as directory:
-            ssh_aliases = ['127.0.0.%i' % i for i in (1, 2, 3, 4, 5, 6, 7, 8)]
-            with SSHServer() as server:
-                foreach(ssh_aliases, 'echo $SSH_CONNECTION',
-                        concurrency=3, logs_directory=directory,
-                        capture=True, **server.client_options)
-            log_files = os.listdir(directory)
-            assert len(log_files) == len(ssh_aliases)
-            assert all(os.path.getsize(os.path.join(directory, fn)) > 0 for fn in log_files)
+        directory = self.create_temporary_directory()
+        ssh_aliases = ['127.0.0.%i' % i for i in (1, 2, 3, 4, 5, 6, 7, 8)]
+        foreach(ssh_aliases, 'echo $SSH_CONNECTION',
+                concurrency=3, logs_directory=directory,
+                capture=True, **self.get_ssh_server().client_options)
+        log_files = os.listdir(directory)
+        assert len(log_files) == len(ssh_aliases)
+        assert all(os.path.getsize(os.path.join(directory, fn)) > 0 for fn in log_files)
 
     def test_chroot_command(self):
         """
@@ -1114,8 +1251,7 @@ class ExecutorTestCase(TestCase):
 
     def test_remote_context(self):
         """Test a remote command context."""
-        with SSHServer() as server:
-            self.check_context(RemoteContext('127.0.0.1', **server.client_options))
+        self.check_context(RemoteContext('127.0.0.1', **self.get_ssh_server().client_options))
 
     def check_context(self, context):
         """Test a command execution context (whether local or remote)."""
@@ -1177,7 +1313,7 @@ class ExecutorTestCase(TestCase):
         # are binary safe (i.e. they should be usable for non-text files).
         random_file = os.path.join(tempfile.gettempdir(), uuid.uuid4().hex)
         assert not os.path.exists(random_file)
-        expected_contents = bytes(random.randint(0, 255) for i in range(25))
+        expected_contents = os.urandom(25)
         context.write_file(random_file, expected_contents)
         # Make sure the file was indeed created.
         assert os.path.exists(random_file)
@@ -1186,7 +1322,7 @@ class ExecutorTestCase(TestCase):
         assert actual_contents == expected_contents
         # Test the happy path in context.atomic_write().
         random_file = os.path.join(tempfile.gettempdir(), uuid.uuid4().hex)
-        expected_contents = bytes(random.randint(0, 255) for i in range(25))
+        expected_contents = os.urandom(25)
         assert not context.exists(random_file)
         with context.atomic_write(random_file) as temporary_file:
             context.write_file(temporary_file, expected_contents)
@@ -1218,15 +1354,15 @@ class ExecutorTestCase(TestCase):
             'and\twith\ttabs',
             'and\nfinally\nnewlines',
         ]
-        with TemporaryDirectory() as directory:
-            # Create files with nasty names :-).
-            for filename in nasty_filenames:
-                with open(os.path.join(directory, filename), 'w') as handle:
-                    handle.write('\n')
-            # List the directory entries.
-            parsed_filenames = context.list_entries(directory)
-            # Make sure all filenames were parsed correctly.
-            assert sorted(nasty_filenames) == sorted(parsed_filenames)
+        directory = self.create_temporary_directory()
+        # Create files with nasty names :-).
+        for filename in nasty_filenames:
+            with open(os.path.join(directory, filename), 'w') as handle:
+                handle.write('\n')
+        # List the directory entries.
+        parsed_filenames = context.list_entries(directory)
+        # Make sure all filenames were parsed correctly.
+        assert sorted(nasty_filenames) == sorted(parsed_filenames)
 
     def test_cli_usage(self):
         """Make sure the command line interface properly presents its usage message."""
@@ -1237,11 +1373,11 @@ class ExecutorTestCase(TestCase):
 
     def test_cli_return_codes(self):
         """Make sure the command line interface doesn't swallow exit codes."""
-        returncode, output = run_cli(main, *python_golf('import sys', 'sys.exit(0)'))
+        returncode, output = run_cli(main, 'true')
         assert returncode == 0
-        returncode, output = run_cli(main, *python_golf('import sys', 'sys.exit(1)'))
+        returncode, output = run_cli(main, 'false')
         assert returncode == 1
-        returncode, output = run_cli(main, *python_golf('import sys', 'sys.exit(42)'))
+        returncode, output = run_cli(main, DEFAULT_SHELL, '-c', 'exit 42')
         assert returncode == 42
 
     def test_cli_fudge_factor(self, fudge_factor=5):
@@ -1251,7 +1387,7 @@ class ExecutorTestCase(TestCase):
             returncode, output = run_cli(
                 main,
                 '--fudge-factor=%i' % fudge_factor,
-                *python_golf('import sys', 'sys.exit(0)')
+                'true',
             )
             assert returncode == 0
             assert timer.elapsed_time > (fudge_factor / 2.0)
@@ -1262,7 +1398,7 @@ class ExecutorTestCase(TestCase):
         returncode, output = run_cli(
             main,
             '--exclusive',
-            *python_golf('import sys', 'sys.exit(0)')
+            'true',
         )
         assert returncode == 0
 
@@ -1272,7 +1408,7 @@ class ExecutorTestCase(TestCase):
             timer = Timer()
             returncode, output = run_cli(
                 main, '--timeout=5',
-                *python_golf('import time', 'time.sleep(10)')
+                'sleep', '10',
             )
             assert returncode != 0
             assert timer.elapsed_time < 10
@@ -1291,7 +1427,7 @@ def intercept(exc_type, func, *args, **kw):
 
 def tokenize_command_line(cmd):
     """Tokenize a command line string into a list of strings."""
-    return sum(map(shlex.split, cmd.command_line), [])
+    return shlex.split(' '.join(cmd.command_line))
 
 
 def python_golf(*statements):
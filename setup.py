@@ -3,7 +3,7 @@
 # Programmer friendly subprocess wrapper.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: February 29, 2020
+# Last Change: October 16, 2026
 # URL: https://executor.readthedocs.io
 
 """
@@ -25,7 +25,7 @@ import os
 import re
 
 # De-facto standard solution for Python packaging.
-from setuptools import setup, find_packages
+from setuptools import setup
 
 
 def get_contents(*args):
@@ -44,13 +44,15 @@ def get_version(*args):
 def get_requirements(*args):
     """Get requirements from pip requirement files."""
     requirements = set()
+    comment_pattern = re.compile(r'^#.*|\s#.*')
+    whitespace_pattern = re.compile(r'\s+')
     with open(get_absolute_path(*args)) as handle:
         for line in handle:
             # Strip comments.
-            line = re.sub(r'^#.*|\s#.*', '', line)
+            line = comment_pattern.sub('', line)
             # Ignore empty lines
             if line and not line.isspace():
-                requirements.add(re.sub(r'\s+', '', line))
+                requirements.add(whitespace_pattern.sub('', line))
     return sorted(requirements)
 
 
@@ -67,7 +69,7 @@ setup(name='executor',
       author="Peter Odding",
       author_email='peter@peterodding.com',
       license='MIT',
-      packages=find_packages(),
+      packages=['executor', 'executor.ssh'],
       entry_points=dict(console_scripts=[
           'executor = executor.cli:main',
       ]),